@@ -2,12 +2,13 @@ import os
 import logging
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from openai import OpenAI
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends, status
+from openai import OpenAI, AsyncOpenAI
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends, Query, Header, WebSocket, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field, validator
 import base64
+import asyncio
 from typing import Optional, List, Dict, Any
 
 # Import authentication modules
@@ -15,16 +16,26 @@ from auth import (
     User, UserRegister, UserLogin, UserResponse, Token,
     get_db, create_user, authenticate_user, create_access_token,
     verify_user_email, get_current_verified_user, get_current_user,
-    ACCESS_TOKEN_EXPIRE_MINUTES, get_password_hash, verify_password
+    ACCESS_TOKEN_EXPIRE_MINUTES, get_password_hash, verify_password,
+    TokenData, verify_token, session_cache
 )
+from sessions import SESSION_AUTH, create_session, revoke_session, run_session_refresher
+from history import (
+    ChatHistoryPage, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE,
+    save_chat_history, get_history_page, iter_history_ndjson
+)
+from search import ChatSearchPage, SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE, SEARCH_MAX_OFFSET, search_history
+from usage import UsageResponse, usage_tracker, run_usage_flusher
+from ws_chat import ChatSocket
+from router import model_router
+from fast_responses import DefaultJSONResponse, CompressionMiddleware, model_response
+from logging_config import setup_logging, shutdown_logging, RequestContextMiddleware
+from idempotency import IdempotencyMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (queued, non-blocking JSON logs; see logging_config.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -34,20 +45,27 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 ALLOWED_FILE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+SYSTEM_PROMPT = "You are a helpful and knowledgeable assistant. Provide accurate, concise, and helpful responses using markdown formatting when appropriate."
 
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
-# Initialize OpenAI client
+# Initialize OpenAI clients (the async client streams WebSocket responses)
 client = OpenAI(api_key=OPENAI_API_KEY)
+async_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 # Initialize FastAPI app
 app = FastAPI(
     title="AI Chatbot API",
     description="An AI chatbot with text and image capabilities and user authentication",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=DefaultJSONResponse
 )
 
+# Replay or join retried requests that carry an Idempotency-Key
+# (added first so it sits inside CORS and compression)
+app.add_middleware(IdempotencyMiddleware)
+
 # Add CORS middleware with proper configuration
 app.add_middleware(
     CORSMiddleware,
@@ -57,6 +75,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress complete (non-streamed) responses above COMPRESSION_MIN_SIZE
+app.add_middleware(CompressionMiddleware)
+
+# Request IDs and log sampling (outermost, so every log line of a request carries its ID)
+app.add_middleware(RequestContextMiddleware)
+
 # Authentication routes are handled directly in this file
 
 # Pydantic models
@@ -113,8 +137,11 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
             )
         
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        token_claims = {"sub": user.username}
+        if SESSION_AUTH:
+            token_claims["sid"] = create_session(db, user.id, access_token_expires)
         access_token = create_access_token(
-            data={"sub": user.username}, expires_delta=access_token_expires
+            data=token_claims, expires_delta=access_token_expires
         )
         
         return {"access_token": access_token, "token_type": "bearer"}
@@ -124,6 +151,20 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
         logger.error(f"Login error: {e}")
         raise HTTPException(status_code=500, detail="Login failed")
 
+@app.post("/auth/logout")
+async def logout(token_data: TokenData = Depends(verify_token), db: Session = Depends(get_db)):
+    """Revoke the current session (session auth mode only)"""
+    if not token_data.session_id:
+        return {"message": "Logged out. Discard the access token on the client."}
+    
+    try:
+        revoke_session(db, token_data.session_id)
+        session_cache.revoke(token_data.session_id)
+        return {"message": "Logged out successfully"}
+    except Exception as e:
+        logger.error(f"Logout error: {e}")
+        raise HTTPException(status_code=500, detail="Logout failed")
+
 @app.post("/auth/verify-email")
 async def verify_email(verification_token: str, db: Session = Depends(get_db)):
     """Verify user email with token"""
@@ -154,42 +195,50 @@ async def health_check():
 @app.post("/chat", response_model=ChatResponse)
 async def chat_with_ai(
     chat_request: ChatRequest,
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_verified_user),
+    latency_tier: Optional[str] = Header(None, alias="X-Latency-Tier")
 ):
     """
     Endpoint to receive a text prompt and return AI response (requires authentication)
     """
+    await usage_tracker.check_quota(current_user.id)
+    
     try:
-        logger.info(f"User {current_user.username} sent chat request: {chat_request.message[:50]}...")
+        logger.info("User %s sent chat request: %.50s...", current_user.username, chat_request.message)
         
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
+        decision = model_router.route(chat_request.message, has_image=False, tier=latency_tier)
+        completion, model_used = model_router.complete(
+            client,
+            decision,
             messages=[
                 {
                     "role": "system",
-                    "content": "You are a helpful and knowledgeable assistant. Provide accurate, concise, and helpful responses using markdown formatting when appropriate."
+                    "content": SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
                     "content": chat_request.message
                 }
             ],
-            max_tokens=1000,
             temperature=0.7
         )
         
+        usage_tracker.record(current_user.id, model_used, completion.usage)
         response_content = completion.choices[0].message.content or "I apologize, but I couldn't generate a response."
         
-        logger.info(f"Successfully generated AI response for user {current_user.username}")
+        logger.info("Successfully generated AI response for user %s", current_user.username,
+                    extra={"model": model_used, "route_reason": decision.reason})
         
-        return ChatResponse(
+        await asyncio.to_thread(save_chat_history, current_user.id, chat_request.message, response_content, model_used)
+        
+        return model_response(ChatResponse(
             response=response_content,
-            model_used="gpt-4o-mini",
+            model_used=model_used,
             timestamp=datetime.now().isoformat()
-        )
+        ))
         
     except Exception as e:
-        logger.error(f"Error in chat endpoint for user {current_user.username}: {str(e)}")
+        logger.error("Error in chat endpoint for user %s: %s", current_user.username, e)
         raise HTTPException(
             status_code=500,
             detail="Sorry, I'm having trouble processing your request. Please try again."
@@ -199,13 +248,16 @@ async def chat_with_ai(
 async def chat_with_image(
     prompt: str = Form(..., min_length=1, max_length=2000),
     file: Optional[UploadFile] = File(None),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_verified_user),
+    latency_tier: Optional[str] = Header(None, alias="X-Latency-Tier")
 ):
     """
     Endpoint to process text with optional image upload (requires authentication)
     """
+    await usage_tracker.check_quota(current_user.id)
+    
     try:
-        logger.info(f"User {current_user.username} sent image chat request: {prompt[:50]}...")
+        logger.info("User %s sent image chat request: %.50s...", current_user.username, prompt)
         
         # Validate file if provided
         if file:
@@ -228,8 +280,10 @@ async def chat_with_image(
             base64_image = base64.b64encode(file_content).decode("utf-8")
             
             # Create completion with image
-            completion = client.chat.completions.create(
-                model="gpt-4o",
+            decision = model_router.route(prompt, has_image=True, tier=latency_tier)
+            completion, model_used = model_router.complete(
+                client,
+                decision,
                 messages=[
                     {
                         "role": "user",
@@ -239,57 +293,113 @@ async def chat_with_image(
                                 "type": "image_url",
                                 "image_url": {
                                     "url": f"data:{file.content_type};base64,{base64_image}",
-                                    "detail": "high"
+                                    "detail": decision.detail
                                 }
                             }
                         ]
                     }
                 ],
-                max_tokens=1000,
                 temperature=0.7
             )
             
-            model_used = "gpt-4o"
-            
         else:
             # Text-only completion
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
+            decision = model_router.route(prompt, has_image=False, tier=latency_tier)
+            completion, model_used = model_router.complete(
+                client,
+                decision,
                 messages=[
                     {
                         "role": "system",
-                        "content": "You are a helpful and knowledgeable assistant. Provide accurate, concise, and helpful responses using markdown formatting when appropriate."
+                        "content": SYSTEM_PROMPT
                     },
                     {
                         "role": "user",
                         "content": prompt
                     }
                 ],
-                max_tokens=1000,
                 temperature=0.7
             )
-            
-            model_used = "gpt-4o-mini"
         
+        usage_tracker.record(current_user.id, model_used, completion.usage)
         response_content = completion.choices[0].message.content or "I apologize, but I couldn't generate a response."
         
-        logger.info(f"Successfully generated AI response with image for user {current_user.username}")
+        logger.info("Successfully generated AI response with image for user %s", current_user.username,
+                    extra={"model": model_used, "route_reason": decision.reason})
+        
+        await asyncio.to_thread(save_chat_history, current_user.id, prompt, response_content, model_used)
         
-        return ChatResponse(
+        return model_response(ChatResponse(
             response=response_content,
             model_used=model_used,
             timestamp=datetime.now().isoformat()
-        )
+        ))
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error in image chat endpoint for user {current_user.username}: {str(e)}")
+        logger.error("Error in image chat endpoint for user %s: %s", current_user.username, e)
         raise HTTPException(
             status_code=500,
             detail="Sorry, I'm having trouble processing your request. Please try again."
         )
 
+# WebSocket chat endpoint
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Authenticated chat channel: authenticate once, then send many chat turns
+    (text and image references) over one connection with streamed responses
+    """
+    await ChatSocket(websocket, async_client, SYSTEM_PROMPT, ALLOWED_FILE_TYPES, MAX_FILE_SIZE).run()
+
+# Usage endpoint
+@app.get("/usage/me", response_model=UsageResponse)
+async def get_my_usage(current_user: User = Depends(get_current_verified_user)):
+    """Get the current user's token usage and quotas"""
+    return model_response(await usage_tracker.get_usage(current_user.id))
+
+# Chat history endpoints
+@app.get("/chat/history", response_model=ChatHistoryPage)
+async def chat_history(
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    current_user: User = Depends(get_current_verified_user),
+    db: Session = Depends(get_db)
+):
+    """Get the current user's chat history, newest first (cursor paginated)"""
+    try:
+        return model_response(await asyncio.to_thread(get_history_page, db, current_user.id, limit, cursor))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching chat history for user {current_user.username}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to load chat history")
+
+@app.get("/chat/history/search", response_model=ChatSearchPage)
+async def search_chat_history(
+    q: str = Query(..., min_length=1, max_length=200, description="Search terms"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+    current_user: User = Depends(get_current_verified_user),
+    db: Session = Depends(get_db)
+):
+    """Full-text search over the current user's chat history, best matches first"""
+    try:
+        return model_response(await asyncio.to_thread(search_history, db, current_user.id, q, limit, offset))
+    except Exception as e:
+        logger.error(f"Error searching chat history for user {current_user.username}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search chat history")
+
+@app.get("/chat/history/export")
+async def export_chat_history(current_user: User = Depends(get_current_verified_user)):
+    """Stream the current user's full chat history as NDJSON"""
+    return StreamingResponse(
+        iter_history_ndjson(current_user.id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="chat-history-{current_user.username}.ndjson"'}
+    )
+
 # Legacy endpoint for backward compatibility (now protected)
 @app.post("/", response_model=ChatResponse)
 async def legacy_chat(
@@ -297,7 +407,7 @@ async def legacy_chat(
     current_user: User = Depends(get_current_verified_user)
 ):
     """Legacy endpoint for backward compatibility (now protected)"""
-    return await chat_with_ai(chat_request, current_user)
+    return await chat_with_ai(chat_request, current_user, None)
 
 # Legacy upload endpoint for backward compatibility (now protected)
 @app.post("/uploadfile/", response_model=ChatResponse)
@@ -307,7 +417,13 @@ async def legacy_upload(
     current_user: User = Depends(get_current_verified_user)
 ):
     """Legacy upload endpoint for backward compatibility (now protected)"""
-    return await chat_with_image(prompt, file, current_user)
+    return await chat_with_image(prompt, file, current_user, None)
+
+# Routing metrics endpoint
+@app.get("/metrics/routing")
+async def routing_metrics():
+    """Model routing decisions and recent per-model latency/error rates"""
+    return model_router.metrics()
 
 # Database health check endpoint
 @app.get("/health/db")
@@ -360,17 +476,37 @@ async def startup_event():
         # else:
         #     logger.error("Database connection failed")
             
+        
+        # Periodically write aggregated token usage to the database
+        app.state.usage_flusher = asyncio.create_task(run_usage_flusher(usage_tracker))
+        
+        # Keep the session revocation cache in step with user_sessions
+        if SESSION_AUTH:
+            await asyncio.to_thread(session_cache.refresh)
+            app.state.session_refresher = asyncio.create_task(run_session_refresher(session_cache))
+            
     except Exception as e:
         logger.error(f"Startup error: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush in-memory state before exiting"""
+    for task_name in ("usage_flusher", "session_refresher"):
+        task = getattr(app.state, task_name, None)
+        if task:
+            task.cancel()
+    await asyncio.to_thread(usage_tracker.flush)
+    shutdown_logging()
+
 # Error handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """Custom HTTP exception handler"""
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail, "timestamp": datetime.now().isoformat()}
+        content={"detail": exc.detail, "timestamp": datetime.now().isoformat()},
+        headers=exc.headers
     )
 
 @app.exception_handler(Exception)
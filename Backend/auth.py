@@ -17,6 +17,7 @@ from sqlalchemy.orm import Session
 
 # Import database configuration
 from database_config import Base, SessionLocal, engine, get_database
+from sessions import SESSION_AUTH, SessionRevocationCache
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))
@@ -30,6 +31,9 @@ SMTP_USERNAME = os.getenv("SMTP_USERNAME")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USERNAME)
 
+# Revoked server-side sessions (only consulted when AUTH_MODE=session)
+session_cache = SessionRevocationCache(timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -95,11 +99,12 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    session_id: Optional[str] = None
 
 # Utility Functions
 def get_db():
     """Get database session - uses the centralized database configuration"""
-    return get_database()
+    yield from get_database()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -117,9 +122,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def decode_access_token(token: str) -> TokenData:
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
         if username is None or not isinstance(username, str):
             raise HTTPException(
@@ -127,7 +132,14 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
                 detail="Could not validate credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        token_data = TokenData(username=username)
+        session_id = payload.get("sid")
+        if SESSION_AUTH and (not isinstance(session_id, str) or session_cache.is_revoked(session_id)):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Session expired or revoked",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        token_data = TokenData(username=username, session_id=session_id)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -136,6 +148,9 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
         )
     return token_data
 
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return decode_access_token(credentials.credentials)
+
 def get_current_user(db: Session = Depends(get_db), token_data: TokenData = Depends(verify_token)):
     user = db.query(User).filter(User.username == token_data.username).first()
     if user is None:
@@ -159,6 +174,11 @@ def get_current_verified_user(current_user: User = Depends(get_current_active_us
         )
     return current_user
 
+def authenticate_token(db: Session, token_data: TokenData):
+    """Resolve a decoded access token to a verified user (for non-HTTP transports such as WebSockets)"""
+    user = get_current_user(db, token_data)
+    return get_current_verified_user(get_current_active_user(user))
+
 def generate_verification_token():
     return secrets.token_urlsafe(32)
 
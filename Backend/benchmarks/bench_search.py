@@ -0,0 +1,88 @@
+"""
+Benchmark chat history search: LIKE scan vs the FTS5 index from search.py.
+
+Usage (from the Backend directory):
+    python benchmarks/bench_search.py --rows 1000000 --users 10
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# Point the app's database configuration at a throwaway SQLite file
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_search.db")
+os.environ["ENVIRONMENT"] = "production"
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+from database_config import SessionLocal, engine  # noqa: E402
+from search import search_history  # noqa: E402
+
+# Zipf-like vocabulary: a few very common words and a long tail of rare ones
+COMMON_WORDS = "the a to of and in is it you that for on with as can this be".split()
+RARE_WORDS = [f"term{n}" for n in range(50000)]
+
+LIKE_QUERY = text("""
+    SELECT id, message, response, model_used, created_at FROM chat_history
+    WHERE user_id = :user_id AND (message LIKE :pattern OR response LIKE :pattern)
+    ORDER BY created_at DESC LIMIT 20
+""")
+
+def sentence(rng, length):
+    return " ".join(
+        rng.choice(COMMON_WORDS) if rng.random() < 0.5 else RARE_WORDS[int(rng.paretovariate(1.0)) % len(RARE_WORDS)]
+        for _ in range(length)
+    )
+
+def populate(rows, users, batch_size=10000):
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    insert = text("""
+        INSERT INTO chat_history (user_id, message, response, model_used, created_at)
+        VALUES (:user_id, :message, :response, 'gpt-4o-mini', :created_at)
+    """)
+    for offset in range(0, rows, batch_size):
+        batch = [{
+            "user_id": (offset + i) % users + 1,
+            "message": sentence(rng, 12),
+            "response": sentence(rng, 60),
+            "created_at": start + timedelta(seconds=offset + i),
+        } for i in range(min(batch_size, rows - offset))]
+        with engine.begin() as conn:
+            conn.execute(insert, batch)
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    populate(args.rows, args.users)
+    print(f"Inserted {args.rows} rows (FTS maintained by triggers) in {time.perf_counter() - t0:.1f}s")
+
+    db = SessionLocal()
+    try:
+        for term in ("term9", "term120 term7", "term4321", "nomatch"):
+            like_ms = timed(lambda: db.execute(LIKE_QUERY, {"user_id": 1, "pattern": f"%{term}%"}).all(), args.repeat)
+            fts_ms = timed(lambda: search_history(db, 1, term), args.repeat)
+            print(f"{term!r:18} LIKE: {like_ms:9.2f} ms   FTS5: {fts_ms:9.2f} ms")
+    finally:
+        db.close()
+        os.remove(DB_PATH)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark chat response serialization cost and bytes on the wire.
+
+Compares FastAPI's default path (validate + jsonable_encoder + json.dumps)
+with orjson and the precompiled pydantic-core serializer, then reports the
+size of a typical ~1000-token markdown answer raw, gzipped and brotli'd.
+
+Usage (from the Backend directory):
+    python benchmarks/bench_serialization.py --iterations 20000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import BaseModel  # noqa: E402
+from fast_responses import compress  # noqa: E402
+
+# Same shape as app.ChatResponse (importing app needs an OpenAI key and a database)
+class ChatResponse(BaseModel):
+    response: str
+    model_used: str
+    timestamp: str
+
+WORDS = (
+    "the model returns a response with code examples and explanations for each step "
+    "you can use python async functions database queries caching and indexes to improve latency"
+).split()
+
+def markdown_answer(tokens: int = 1000) -> str:
+    """Roughly `tokens` tokens (~0.75 words per token) of markdown"""
+    rng = random.Random(7)
+    lines = ["## Answer", ""]
+    words = int(tokens * 0.75)
+    while words > 0:
+        if rng.random() < 0.15:
+            lines += ["```python", "async def handler(request):", "    return await service.call(request)", "```"]
+            words -= 8
+        else:
+            length = rng.randint(8, 20)
+            lines.append("- " + " ".join(rng.choice(WORDS) for _ in range(length)) + ".")
+            words -= length
+    return "\n".join(lines)
+
+def timed(fn, iterations):
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - t0) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=1000)
+    args = parser.parse_args()
+
+    model = ChatResponse(response=markdown_answer(args.tokens), model_used="gpt-4o-mini",
+                         timestamp=datetime.now().isoformat())
+
+    paths = {
+        "fastapi default (validate + encoder + json)": lambda: json.dumps(
+            jsonable_encoder(ChatResponse.model_validate(model.model_dump())),
+            ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8"),
+        "orjson (model_dump + orjson.dumps)": lambda: orjson.dumps(model.model_dump()),
+        "precompiled (pydantic-core to_json)": lambda: model.__pydantic_serializer__.to_json(model),
+    }
+    print(f"Serialization of a ~{args.tokens}-token response:")
+    for name, fn in paths.items():
+        print(f"  {name:45} {timed(fn, args.iterations):8.2f} us")
+
+    body = model.__pydantic_serializer__.to_json(model)
+    print("Bytes on wire:")
+    for name, size in (("identity", len(body)), ("gzip", len(compress(body, "gzip"))), ("br", len(compress(body, "br")))):
+        print(f"  {name:10} {size:8d} bytes ({size / len(body):.0%})")
+
+if __name__ == "__main__":
+    main()
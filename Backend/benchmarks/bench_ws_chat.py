@@ -0,0 +1,108 @@
+"""
+Benchmark chat turns/sec: POST /chat vs the /ws/chat WebSocket channel.
+
+The OpenAI clients are replaced by instant fakes so that only the server-side
+per-turn overhead (CORS, JWT decoding, user lookup, JSON parsing) is measured.
+
+Usage (from the Backend directory):
+    python benchmarks/bench_ws_chat.py --turns 500
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+# Point the app's database configuration at a throwaway SQLite file
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_ws_chat.db")
+os.environ["ENVIRONMENT"] = "production"
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+import app  # noqa: E402
+from auth import SessionLocal, User, create_access_token  # noqa: E402
+
+logging.disable(logging.INFO)
+
+ANSWER = "This is a benchmark answer. " * 20
+USAGE = SimpleNamespace(prompt_tokens=20, completion_tokens=100, total_tokens=120)
+
+def fake_completion(**kwargs):
+    message = SimpleNamespace(content=ANSWER)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=USAGE)
+
+class FakeStream:
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for piece in self.pieces:
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+        yield SimpleNamespace(usage=USAGE, choices=[])
+
+    async def close(self):
+        pass
+
+async def fake_stream(**kwargs):
+    return FakeStream([ANSWER])
+
+def create_user():
+    db = SessionLocal()
+    try:
+        db.add(User(username="bench", email="bench@example.com", hashed_password="-", is_verified=True))
+        db.commit()
+    finally:
+        db.close()
+    return create_access_token({"sub": "bench"})
+
+def bench_post(client, token, turns):
+    headers = {"Authorization": f"Bearer {token}"}
+    t0 = time.perf_counter()
+    for i in range(turns):
+        response = client.post("/chat", json={"message": f"question {i}"}, headers=headers)
+        assert response.status_code == 200, response.text
+    return turns / (time.perf_counter() - t0)
+
+def bench_ws(client, token, turns):
+    t0 = time.perf_counter()
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "auth", "token": token})
+        assert ws.receive_json()["type"] == "ready"
+        for i in range(turns):
+            ws.send_json({"type": "chat", "id": str(i), "message": f"question {i}"})
+            while ws.receive_json()["type"] != "done":
+                pass
+    return turns / (time.perf_counter() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=500)
+    args = parser.parse_args()
+
+    app.client.chat.completions.create = fake_completion
+    app.async_client.chat.completions.create = fake_stream
+    token = create_user()
+
+    try:
+        with TestClient(app.app) as client:
+            # Warm up both paths
+            bench_post(client, token, 10)
+            bench_ws(client, token, 10)
+
+            post_rate = bench_post(client, token, args.turns)
+            ws_rate = bench_ws(client, token, args.turns)
+    finally:
+        os.remove(DB_PATH)
+
+    print(f"POST /chat: {post_rate:8.1f} turns/sec")
+    print(f"/ws/chat:   {ws_rate:8.1f} turns/sec ({ws_rate / post_rate:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import gzip
+from typing import List, Optional
+
+import brotli
+import orjson
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+# Configuration
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+# Streamed bodies are flushed as produced and must not be buffered
+UNCOMPRESSED_MEDIA_TYPES = ("text/event-stream", "application/x-ndjson")
+
+class DefaultJSONResponse(JSONResponse):
+    """orjson-backed default response class for the app"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+def model_response(model: BaseModel, status_code: int = 200) -> Response:
+    """
+    Serialize a response model with its precompiled pydantic-core serializer,
+    skipping FastAPI's re-validation and jsonable_encoder pass
+    """
+    return Response(
+        content=model.__pydantic_serializer__.to_json(model),
+        status_code=status_code,
+        media_type="application/json"
+    )
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header (honouring q=0)"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip())
+    if "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+class CompressionMiddleware:
+    """
+    Negotiated brotli/gzip compression for complete response bodies of at least
+    `minimum_size` bytes. Streamed responses (more than one body message, or an
+    NDJSON/SSE media type), already-encoded responses and WebSockets pass through.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        encoding = negotiate_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                response_headers = {
+                    key.lower(): value for key, value in message.get("headers", [])
+                }
+                media_type = response_headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in response_headers or media_type.startswith(UNCOMPRESSED_MEDIA_TYPES):
+                    passthrough = True
+                    await send(message)
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if start_message is not None:
+                start, start_message = start_message, None
+                if message.get("more_body", False) or len(body) < self.minimum_size:
+                    # Streamed or small: send unchanged
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                compressed = compress(body, encoding)
+                vary = [b"Accept-Encoding"]
+                response_headers: List = []
+                for key, value in start.get("headers", []):
+                    if key.lower() == b"vary":
+                        vary.insert(0, value)
+                    elif key.lower() != b"content-length":
+                        response_headers.append((key, value))
+                response_headers += [
+                    (b"content-encoding", encoding.encode("latin-1")),
+                    (b"content-length", str(len(compressed)).encode("latin-1")),
+                    (b"vary", b", ".join(vary)),
+                ]
+                await send({**start, "headers": response_headers})
+                await send({"type": "http.response.body", "body": compressed})
+                return
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
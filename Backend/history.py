@@ -0,0 +1,139 @@
+import base64
+import logging
+from datetime import datetime
+from typing import Optional, List, Tuple, Iterator
+
+import orjson
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index, select, tuple_
+from sqlalchemy.orm import Session
+
+# Import database configuration
+from database_config import Base, SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+HISTORY_EXPORT_BATCH_SIZE = 500
+
+# Database Models
+class ChatHistory(Base):
+    """Stored chat exchange - mirrors the chat_history table in database/init.sql"""
+    __tablename__ = "chat_history"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer)
+    message = Column(Text, nullable=False)
+    response = Column(Text, nullable=False)
+    model_used = Column(String(50), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# Composite index matching the keyset ordering, so a page is a single index
+# range scan instead of a sort over all of the user's rows
+chat_history_keyset_index = Index(
+    "idx_chat_history_user_created_id",
+    ChatHistory.user_id, ChatHistory.created_at, ChatHistory.id
+)
+
+# Create tables and indexes (the index is created separately so that it is
+# also added when init.sql already created the table)
+Base.metadata.create_all(bind=engine)
+chat_history_keyset_index.create(bind=engine, checkfirst=True)
+
+# Only the columns the API returns are selected
+HISTORY_COLUMNS = (
+    ChatHistory.id,
+    ChatHistory.message,
+    ChatHistory.response,
+    ChatHistory.model_used,
+    ChatHistory.created_at,
+)
+
+# Pydantic Models
+class ChatHistoryItem(BaseModel):
+    id: int
+    message: str
+    response: str
+    model_used: str
+    created_at: datetime
+
+class ChatHistoryPage(BaseModel):
+    items: List[ChatHistoryItem]
+    next_cursor: Optional[str] = None
+
+# Utility Functions
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+
+def save_chat_history(user_id: int, message: str, response: str, model_used: str):
+    """Store a chat exchange; failures are logged and never break the chat response"""
+    db = SessionLocal()
+    try:
+        entry = ChatHistory(
+            user_id=user_id,
+            message=message,
+            response=response,
+            model_used=model_used
+        )
+        db.add(entry)
+        db.commit()
+        return entry
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to save chat history for user {user_id}: {e}")
+        return None
+    finally:
+        db.close()
+
+def get_history_page(db: Session, user_id: int, limit: int = HISTORY_PAGE_SIZE,
+                     cursor: Optional[str] = None) -> ChatHistoryPage:
+    """Return one page of a user's history, newest first, using keyset pagination"""
+    query = select(*HISTORY_COLUMNS).where(ChatHistory.user_id == user_id)
+
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(
+            tuple_(ChatHistory.created_at, ChatHistory.id) < tuple_(created_at, row_id)
+        )
+
+    # Fetch one extra row to know whether another page exists
+    query = query.order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc()).limit(limit + 1)
+    rows = db.execute(query).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return ChatHistoryPage(
+        items=[ChatHistoryItem(**row._mapping) for row in rows],
+        next_cursor=next_cursor
+    )
+
+def iter_history_ndjson(user_id: int) -> Iterator[bytes]:
+    """Yield a user's full history as NDJSON lines, oldest first, in fixed-size batches"""
+    db = SessionLocal()
+    try:
+        query = (
+            select(*HISTORY_COLUMNS)
+            .where(ChatHistory.user_id == user_id)
+            .order_by(ChatHistory.created_at, ChatHistory.id)
+            .execution_options(stream_results=True, yield_per=HISTORY_EXPORT_BATCH_SIZE)
+        )
+        for row in db.execute(query):
+            yield orjson.dumps(dict(row._mapping)) + b"\n"
+    finally:
+        db.close()
@@ -0,0 +1,247 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "3600"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+# Total size of stored responses (bodies and headers)
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(64 * 1024 * 1024)))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "120"))
+IDEMPOTENCY_MAX_BODY_SIZE = 1024 * 1024
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+IDEMPOTENT_PATHS = {"/chat", "/chat/image", "/auth/register", "/", "/uploadfile/"}
+
+# Rejections that are transient or happen before the handler runs (auth, validation,
+# quota); a retry must be evaluated again rather than replay them
+UNSTORED_STATUSES = {401, 403, 408, 409, 422, 429}
+
+class StoredResponse:
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.size = len(body) + sum(len(key) + len(value) for key, value in headers)
+
+class IdempotencyEntry:
+    def __init__(self, fingerprint: Optional[str]):
+        self.fingerprint = fingerprint
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.response: Optional[StoredResponse] = None
+        self.expires_at: Optional[float] = None
+
+class IdempotencyStore:
+    """
+    Bounded, TTL-expiring map from idempotency key to the in-flight or completed
+    response. Used from the event loop only, so it needs no locking.
+
+    Only completed entries are evicted (oldest first) to stay within `max_keys`
+    and `max_bytes`; an in-flight key is never dropped, so its retries always
+    wait for it. When every slot is in flight, claim() declines to track the key.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS,
+                 max_bytes: int = IDEMPOTENCY_MAX_BYTES):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self._in_flight: Dict[str, IdempotencyEntry] = {}
+        # Completion order, so expired entries are at the front
+        self._completed: "OrderedDict[str, IdempotencyEntry]" = OrderedDict()
+        self._bytes = 0
+
+    def claim(self, key: str, fingerprint: Optional[str]) -> Tuple[Optional[IdempotencyEntry], bool]:
+        """
+        Return (entry, owner): owner is True when the caller must run the request.
+        Returns (None, False) when the store is full of in-flight keys.
+        """
+        self._expire()
+        entry = self._in_flight.get(key) or self._completed.get(key)
+        if entry is not None:
+            return entry, False
+        if len(self._in_flight) >= self.max_keys:
+            return None, False
+
+        entry = IdempotencyEntry(fingerprint)
+        self._in_flight[key] = entry
+        self._evict()
+        return entry, True
+
+    def complete(self, key: str, entry: IdempotencyEntry, response: Optional[StoredResponse]):
+        """Store the final response, or forget the key (response=None) so it can be retried"""
+        if self._in_flight.get(key) is entry:
+            del self._in_flight[key]
+        if response is not None and response.size <= self.max_bytes:
+            entry.response = response
+            entry.expires_at = time.monotonic() + self.ttl
+            self._completed[key] = entry
+            self._bytes += response.size
+            self._evict()
+        if not entry.done.done():
+            entry.done.set_result(None)
+
+    def _remove_completed(self, key: str):
+        entry = self._completed.pop(key)
+        self._bytes -= entry.response.size
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._completed:
+            key, entry = next(iter(self._completed.items()))
+            if entry.expires_at > now:
+                break
+            self._remove_completed(key)
+
+    def _evict(self):
+        while self._completed and (
+            len(self._completed) + len(self._in_flight) > self.max_keys or self._bytes > self.max_bytes
+        ):
+            self._remove_completed(next(iter(self._completed)))
+
+class IdempotencyMiddleware:
+    """
+    Honour an Idempotency-Key header on POSTs to IDEMPOTENT_PATHS:
+    a completed key replays the stored response, a key that is still in flight
+    waits for and shares the original result. Keys are scoped per path and per
+    caller (Authorization header). 5xx results and UNSTORED_STATUSES are not
+    stored, so the retry runs; 2xx and the handler's own 4xx results are replayed.
+    """
+
+    def __init__(self, app, store: Optional[IdempotencyStore] = None):
+        self.app = app
+        self.store = store or IdempotencyStore()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in IDEMPOTENT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        idempotency_key = headers.get(b"idempotency-key", b"").decode("latin-1").strip()
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            await self.send_error(send, 400, "Idempotency-Key is too long")
+            return
+
+        caller = hashlib.sha256(headers.get(b"authorization", b"")).hexdigest()[:32]
+        key = f"{scope['path']}:{caller}:{idempotency_key}"
+
+        # Fingerprint JSON bodies so a reused key with a different payload is rejected
+        # (multipart boundaries change between retries, so those are not compared)
+        fingerprint = None
+        if headers.get(b"content-type", b"").startswith(b"application/json"):
+            body = await self.read_body(receive)
+            fingerprint = hashlib.sha256(body).hexdigest()
+            receive = self.replay_body(body, receive)
+
+        while True:
+            entry, owner = self.store.claim(key, fingerprint)
+            if entry is None:
+                logger.warning("Idempotency store is full of in-flight requests; running %s untracked", scope["path"])
+                await self.app(scope, receive, send)
+                return
+            if entry.fingerprint != fingerprint:
+                await self.send_error(send, 422, "Idempotency-Key was already used with a different request body")
+                return
+            if owner:
+                await self.run(scope, receive, send, key, entry)
+                return
+
+            if not entry.done.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(entry.done), IDEMPOTENCY_WAIT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    await self.send_error(send, 409, "A request with this Idempotency-Key is still in progress")
+                    return
+            if entry.response is not None:
+                logger.info("Replaying stored response for Idempotency-Key on %s", scope["path"])
+                await self.replay(send, entry.response)
+                return
+            # The original attempt failed; loop to claim the key and run it ourselves
+
+    async def run(self, scope, receive, send, key: str, entry: IdempotencyEntry):
+        status = 500
+        response_headers: List[Tuple[bytes, bytes]] = []
+        chunks: List[bytes] = []
+        size = 0
+
+        client_gone = False
+
+        async def capture(message):
+            nonlocal status, response_headers, size, client_gone
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+                if size <= IDEMPOTENCY_MAX_BODY_SIZE:
+                    chunks.append(message.get("body", b""))
+            if client_gone:
+                return
+            try:
+                await send(message)
+            except Exception:
+                # The client gave up (typically a timeout); keep the result for its retry
+                client_gone = True
+
+        stored = None
+        try:
+            await self.app(scope, receive, capture)
+            if status < 500 and status not in UNSTORED_STATUSES and size <= IDEMPOTENCY_MAX_BODY_SIZE:
+                stored = StoredResponse(status, response_headers, b"".join(chunks))
+        finally:
+            self.store.complete(key, entry, stored)
+
+    async def replay(self, send, response: StoredResponse):
+        await send({
+            "type": "http.response.start",
+            "status": response.status,
+            "headers": [*response.headers, (b"idempotent-replayed", b"true")],
+        })
+        await send({"type": "http.response.body", "body": response.body})
+
+    async def send_error(self, send, status: int, detail: str):
+        body = orjson.dumps({"detail": detail})
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def read_body(receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    def replay_body(body: bytes, receive):
+        """Hand the already-read body to the app, then fall through to the real receive"""
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replay
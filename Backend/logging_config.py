@@ -0,0 +1,163 @@
+import os
+import sys
+import uuid
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+import orjson
+
+# Configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").strip().lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of requests whose INFO/DEBUG logs are kept (warnings and errors are always kept)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+# Per-request logging context
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+log_sampled_var: ContextVar[bool] = ContextVar("log_sampled", default=True)
+
+# Attributes of every LogRecord; anything else came from `extra=` and is emitted as a field
+STANDARD_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+class RequestContextFilter(logging.Filter):
+    """Stamp the request ID and drop INFO/DEBUG records of unsampled requests"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return record.levelno > logging.INFO or log_sampled_var.get()
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller: records are enqueued unformatted
+    (the listener thread formats them) and dropped when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Tracebacks reference live frames, so render them now; everything else is lazy
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class DropReportingListener(logging.handlers.QueueListener):
+    """QueueListener that reports records dropped by the producer side"""
+
+    def __init__(self, log_queue: queue.Queue, producer: DroppingQueueHandler, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.producer = producer
+        self.reported = 0
+
+    def enqueue_sentinel(self):
+        # Wait for room instead of failing when the queue is full at shutdown
+        self.queue.put(self._sentinel, timeout=5)
+
+    def handle(self, record: logging.LogRecord):
+        dropped = self.producer.dropped
+        if dropped != self.reported:
+            super().handle(logging.makeLogRecord({
+                "name": __name__,
+                "levelno": logging.WARNING,
+                "levelname": "WARNING",
+                "msg": "Log queue full, dropped %d records",
+                "args": (dropped - self.reported,),
+                "request_id": None,
+            }))
+            self.reported = dropped
+        super().handle(record)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return orjson.dumps(entry, default=str).decode("utf-8")
+
+class RequestContextMiddleware:
+    """Assign a request ID (from X-Request-ID or a new one) and the sampling decision per request"""
+
+    def __init__(self, app, sample_rate: float = LOG_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        id_token = request_id_var.set(request_id)
+        sampled_token = log_sampled_var.set(self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(id_token)
+            log_sampled_var.reset(sampled_token)
+
+_listener: Optional[DropReportingListener] = None
+
+def setup_logging():
+    """Route all logging through a bounded queue to a stdout writer thread"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = DropReportingListener(log_queue, queue_handler, stream_handler)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
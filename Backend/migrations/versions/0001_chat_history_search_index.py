@@ -0,0 +1,88 @@
+"""Full-text search index for chat_history (PostgreSQL)
+
+Adds chat_history.search_vector without rewriting the table: the column is added
+as a plain nullable tsvector (a catalog-only change), a trigger keeps it current
+for new writes, existing rows are backfilled in short batches, and the
+(user_id, search_vector) GIN index is built CONCURRENTLY so writes continue.
+Run this once per database before enabling search; SQLite builds its FTS5 index
+at startup instead (see search.py).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+SEARCH_LANGUAGE = "english"
+BACKFILL_BATCH_SIZE = 5000
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    generated = bind.execute(sa.text("""
+        SELECT is_generated FROM information_schema.columns
+        WHERE table_name = 'chat_history' AND column_name = 'search_vector'
+    """)).scalar()
+
+    # Databases that already have the STORED generated column keep it
+    if generated != "ALWAYS":
+        op.execute("ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS search_vector tsvector")
+        op.execute(f"""
+            CREATE OR REPLACE FUNCTION chat_history_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := to_tsvector('{SEARCH_LANGUAGE}', coalesce(NEW.message, '') || ' ' || coalesce(NEW.response, ''));
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        op.execute("DROP TRIGGER IF EXISTS chat_history_search_vector_trigger ON chat_history")
+        op.execute("""
+            CREATE TRIGGER chat_history_search_vector_trigger
+            BEFORE INSERT OR UPDATE OF message, response ON chat_history
+            FOR EACH ROW EXECUTE FUNCTION chat_history_search_vector_update()
+        """)
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+
+    with op.get_context().autocommit_block():
+        if generated != "ALWAYS":
+            # Each batch commits on its own, so row locks are held briefly
+            last_id = 0
+            max_id = bind.execute(sa.text("SELECT coalesce(max(id), 0) FROM chat_history")).scalar()
+            while last_id < max_id:
+                bind.execute(sa.text(f"""
+                    UPDATE chat_history
+                    SET search_vector = to_tsvector('{SEARCH_LANGUAGE}', coalesce(message, '') || ' ' || coalesce(response, ''))
+                    WHERE id > :last_id AND id <= :next_id AND search_vector IS NULL
+                """), {"last_id": last_id, "next_id": last_id + BACKFILL_BATCH_SIZE})
+                last_id += BACKFILL_BATCH_SIZE
+
+        # Replace an index that is not scoped by user
+        indexdef = bind.execute(sa.text(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = 'chat_history' AND indexname = 'idx_chat_history_search'"
+        )).scalar()
+        if indexdef is not None and "user_id" not in indexdef:
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_chat_history_search")
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_history_search "
+            "ON chat_history USING GIN (user_id, search_vector)"
+        )
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_chat_history_search")
+    op.execute("DROP TRIGGER IF EXISTS chat_history_search_vector_trigger ON chat_history")
+    op.execute("DROP FUNCTION IF EXISTS chat_history_search_vector_update()")
+    op.execute("ALTER TABLE chat_history DROP COLUMN IF EXISTS search_vector")
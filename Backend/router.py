@@ -0,0 +1,216 @@
+import os
+import time
+import logging
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from pydantic import BaseModel, ValidationInfo, field_validator
+
+logger = logging.getLogger(__name__)
+
+LATENCY_TIERS = ("fast", "standard", "quality")
+DEFAULT_LATENCY_TIER = "standard"
+
+# Pydantic Models
+class RoutingPolicy(BaseModel):
+    """Routing configuration; override any field with a JSON object in MODEL_ROUTING_POLICY"""
+    default_model: str = "gpt-4o-mini"
+    strong_model: str = "gpt-4o"
+    # Text prompts longer than this go to the strong model (standard tier)
+    long_prompt_chars: int = 1500
+    max_tokens: Dict[str, int] = {"fast": 500, "standard": 1000, "quality": 1500}
+    image_detail: Dict[str, str] = {"fast": "low", "standard": "high", "quality": "high"}
+    # A model whose recent p95 latency exceeds the caller's budget is considered degraded
+    latency_budget_ms: Dict[str, float] = {"fast": 4000, "standard": 15000, "quality": 60000}
+    max_error_rate: float = 0.25
+    min_samples: int = 10
+    window_size: int = 200
+    # Older samples are ignored, so a degraded model is retried once they age out
+    window_seconds: float = 120
+
+    @field_validator("max_tokens", "image_detail", "latency_budget_ms", mode="before")
+    @classmethod
+    def merge_tier_defaults(cls, value: Any, info: ValidationInfo) -> Any:
+        """Per-tier overrides are merged over the defaults, so an override may name only some tiers"""
+        if isinstance(value, dict):
+            return {**cls.model_fields[info.field_name].default, **value}
+        return value
+
+class RouteDecision(BaseModel):
+    model: str
+    fallback_model: Optional[str] = None
+    max_tokens: int
+    detail: str
+    tier: str
+    reason: str
+
+    @property
+    def models(self) -> List[str]:
+        return [self.model] + ([self.fallback_model] if self.fallback_model else [])
+
+class ModelStats:
+    """Rolling window of recent call latencies and outcomes for one model"""
+
+    def __init__(self, window_size: int, window_seconds: float):
+        self.window_seconds = window_seconds
+        self.samples: Deque[Tuple[float, float, bool]] = deque(maxlen=window_size)
+
+    def record(self, latency_ms: float, ok: bool):
+        self.samples.append((time.monotonic(), latency_ms, ok))
+
+    def recent(self) -> List[Tuple[float, bool]]:
+        cutoff = time.monotonic() - self.window_seconds
+        return [(latency, ok) for at, latency, ok in list(self.samples) if at >= cutoff]
+
+    def summary(self) -> Dict[str, Any]:
+        samples = self.recent()
+        latencies = sorted(latency for latency, ok in samples if ok)
+        errors = sum(1 for _, ok in samples if not ok)
+        return {
+            "samples": len(samples),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        }
+
+# Failures of the upstream service itself; anything else (bad request, auth,
+# content policy) is the caller's problem and would fail on every model
+UPSTREAM_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError,
+)
+
+def is_upstream_error(error: BaseException) -> bool:
+    """True for transient upstream failures that justify a fallback and count against model health"""
+    if isinstance(error, UPSTREAM_ERRORS):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+class ModelRouter:
+    """Picks model, max_tokens and image detail per request and tracks per-model health"""
+
+    def __init__(self, policy: RoutingPolicy):
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ModelStats] = {
+            model: ModelStats(policy.window_size, policy.window_seconds) for model in (policy.default_model, policy.strong_model)
+        }
+        self._decisions: Counter = Counter()
+        self._fallbacks: Counter = Counter()
+
+    def degraded_reason(self, model: str, tier: str) -> Optional[str]:
+        summary = self._stats[model].summary()
+        if summary["samples"] < self.policy.min_samples:
+            return None
+        if summary["error_rate"] > self.policy.max_error_rate:
+            return "error_rate"
+        if summary["p95_ms"] is not None and summary["p95_ms"] > self.policy.latency_budget_ms[tier]:
+            return "latency"
+        return None
+
+    def route(self, prompt: str, has_image: bool = False, tier: Optional[str] = None) -> RouteDecision:
+        policy = self.policy
+        tier = tier.lower() if isinstance(tier, str) and tier.lower() in LATENCY_TIERS else DEFAULT_LATENCY_TIER
+
+        if has_image and tier != "fast":
+            model, reason = policy.strong_model, "image"
+        elif tier == "quality":
+            model, reason = policy.strong_model, "quality_tier"
+        elif tier == "standard" and len(prompt) > policy.long_prompt_chars:
+            model, reason = policy.strong_model, "long_prompt"
+        else:
+            model, reason = policy.default_model, "default"
+
+        other = policy.default_model if model == policy.strong_model else policy.strong_model
+        degraded = self.degraded_reason(model, tier)
+        if degraded and not self.degraded_reason(other, tier):
+            model, other, reason = other, model, f"fallback_{degraded}"
+
+        decision = RouteDecision(
+            model=model,
+            fallback_model=other,
+            max_tokens=policy.max_tokens[tier],
+            detail=policy.image_detail[tier],
+            tier=tier,
+            reason=reason
+        )
+        with self._lock:
+            self._decisions[(tier, model, reason)] += 1
+        return decision
+
+    def record(self, model: str, latency_ms: float, ok: bool):
+        if model in self._stats:
+            with self._lock:
+                self._stats[model].record(latency_ms, ok)
+
+    @contextmanager
+    def track(self, model: str):
+        """Time an upstream call; only successes and upstream errors are recorded"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            if is_upstream_error(e):
+                self.record(model, (time.perf_counter() - start) * 1000, ok=False)
+            raise
+        self.record(model, (time.perf_counter() - start) * 1000, ok=True)
+
+    def complete(self, client, decision: RouteDecision, messages: List[Dict[str, Any]], **kwargs):
+        """Run a completion on the routed model, retrying once on the fallback model after an upstream error"""
+        last_error = None
+        for model in decision.models:
+            try:
+                with self.track(model):
+                    completion = client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        max_tokens=decision.max_tokens,
+                        **kwargs
+                    )
+                return completion, model
+            except Exception as e:
+                if not is_upstream_error(e):
+                    raise
+                last_error = e
+                logger.warning(f"Model {model} failed, trying fallback: {e}")
+                self.note_fallback(model)
+        raise last_error
+
+    def note_fallback(self, model: str):
+        with self._lock:
+            self._fallbacks[model] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "decisions": [
+                    {"tier": tier, "model": model, "reason": reason, "count": count}
+                    for (tier, model, reason), count in sorted(self._decisions.items())
+                ],
+                "runtime_fallbacks": dict(self._fallbacks),
+                "models": {model: stats.summary() for model, stats in self._stats.items()},
+            }
+
+def load_routing_policy() -> RoutingPolicy:
+    raw = os.getenv("MODEL_ROUTING_POLICY")
+    if not raw:
+        return RoutingPolicy()
+    try:
+        return RoutingPolicy.model_validate_json(raw)
+    except Exception as e:
+        logger.error(f"Invalid MODEL_ROUTING_POLICY, using defaults: {e}")
+        return RoutingPolicy()
+
+# Process-wide router
+model_router = ModelRouter(load_routing_policy())
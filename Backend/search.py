@@ -0,0 +1,182 @@
+import re
+import logging
+from typing import Optional, List
+
+from pydantic import BaseModel
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# Import database configuration
+from database_config import engine
+from history import ChatHistoryItem
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_MAX_OFFSET = 1000
+SEARCH_MAX_TERMS = 16
+SEARCH_LANGUAGE = "english"
+
+# Pydantic Models
+class ChatSearchResult(ChatHistoryItem):
+    rank: float
+
+class ChatSearchPage(BaseModel):
+    items: List[ChatSearchResult]
+    next_offset: Optional[int] = None
+
+# Index setup
+# SQLite: every indexed word is rewritten to q<user_id>x<word>, so each user has their
+# own terms (and doclists) in the FTS5 index and a search never touches other users'
+# postings, prefix expansion included. The prefix has no vowels, so porter stemming
+# of the word is unchanged. The rewrite is a Python SQL function registered on each
+# connection; writes to chat_history must go through the app's engine.
+SQLITE_TERMS_FUNCTION = "chat_search_terms"
+SQLITE_WORD_PATTERN = re.compile(r"[^\W_]+")
+
+SQLITE_FTS_STATEMENTS = [
+    # Older index layouts
+    "DROP TRIGGER IF EXISTS chat_history_fts_ai",
+    "DROP TRIGGER IF EXISTS chat_history_fts_ad",
+    "DROP TRIGGER IF EXISTS chat_history_fts_au",
+    "DROP TABLE IF EXISTS chat_history_fts",
+    # Contentless FTS5 table: the text lives only in chat_history
+    """CREATE VIRTUAL TABLE chat_history_fts USING fts5(
+        message, response, content='', tokenize='porter unicode61'
+    )""",
+    # Triggers keep the inverted index in step with every write
+    f"""CREATE TRIGGER chat_history_fts_ai AFTER INSERT ON chat_history BEGIN
+        INSERT INTO chat_history_fts(rowid, message, response)
+        VALUES (new.id, {SQLITE_TERMS_FUNCTION}(new.user_id, new.message),
+                {SQLITE_TERMS_FUNCTION}(new.user_id, new.response));
+    END""",
+    f"""CREATE TRIGGER chat_history_fts_ad AFTER DELETE ON chat_history BEGIN
+        INSERT INTO chat_history_fts(chat_history_fts, rowid, message, response)
+        VALUES ('delete', old.id, {SQLITE_TERMS_FUNCTION}(old.user_id, old.message),
+                {SQLITE_TERMS_FUNCTION}(old.user_id, old.response));
+    END""",
+    f"""CREATE TRIGGER chat_history_fts_au AFTER UPDATE ON chat_history BEGIN
+        INSERT INTO chat_history_fts(chat_history_fts, rowid, message, response)
+        VALUES ('delete', old.id, {SQLITE_TERMS_FUNCTION}(old.user_id, old.message),
+                {SQLITE_TERMS_FUNCTION}(old.user_id, old.response));
+        INSERT INTO chat_history_fts(rowid, message, response)
+        VALUES (new.id, {SQLITE_TERMS_FUNCTION}(new.user_id, new.message),
+                {SQLITE_TERMS_FUNCTION}(new.user_id, new.response));
+    END""",
+    # Index rows that existed before the FTS table was created
+    f"""INSERT INTO chat_history_fts(rowid, message, response)
+        SELECT id, {SQLITE_TERMS_FUNCTION}(user_id, message), {SQLITE_TERMS_FUNCTION}(user_id, response)
+        FROM chat_history""",
+]
+
+def user_term(user_id: int, word: str) -> str:
+    return f"q{int(user_id)}x{word.lower()}"
+
+def scoped_terms(user_id: Optional[int], value: Optional[str]) -> str:
+    """SQL function body: the user-scoped terms of one text column"""
+    if user_id is None or not value:
+        return ""
+    return " ".join(user_term(user_id, word) for word in SQLITE_WORD_PATTERN.findall(value))
+
+def register_sqlite_functions(dbapi_connection, connection_record=None):
+    dbapi_connection.create_function(SQLITE_TERMS_FUNCTION, 2, scoped_terms, deterministic=True)
+
+def ensure_search_index(bind=engine) -> bool:
+    """
+    Create the SQLite FTS5 index for chat_history, or check that the PostgreSQL
+    index exists (it is created by an alembic migration, see migrations/)
+    """
+    dialect = bind.dialect.name
+    if dialect == "sqlite":
+        event.listen(bind, "connect", register_sqlite_functions)
+        with bind.begin() as conn:
+            # Connections opened before the listener was added
+            register_sqlite_functions(conn.connection.dbapi_connection)
+            table_sql = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'chat_history_fts'")
+            ).scalar()
+            if table_sql is None or "content=''" not in table_sql:
+                for statement in SQLITE_FTS_STATEMENTS:
+                    conn.execute(text(statement))
+        return True
+
+    if dialect == "postgresql":
+        with bind.connect() as conn:
+            ready = conn.execute(text(
+                "SELECT 1 FROM pg_indexes WHERE tablename = 'chat_history' AND indexname = 'idx_chat_history_search'"
+            )).first() is not None
+        if not ready:
+            logger.warning("Chat history search index is missing; run `alembic upgrade head` in Backend/")
+        return ready
+
+    logger.warning(f"Full-text search is not supported for dialect {dialect}")
+    return False
+
+# Queries
+SQLITE_SEARCH_QUERY = text("""
+    SELECT h.id, h.message, h.response, h.model_used, h.created_at,
+           bm25(chat_history_fts) AS rank
+    FROM chat_history_fts
+    JOIN chat_history h ON h.id = chat_history_fts.rowid
+    WHERE chat_history_fts MATCH :query AND h.user_id = :user_id
+    ORDER BY rank, h.id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+# Served by the (user_id, search_vector) GIN index created by the migration
+POSTGRES_SEARCH_QUERY = text(f"""
+    SELECT h.id, h.message, h.response, h.model_used, h.created_at,
+           -ts_rank_cd(h.search_vector, q) AS rank
+    FROM chat_history h, websearch_to_tsquery('{SEARCH_LANGUAGE}', :query) q
+    WHERE h.user_id = :user_id AND h.search_vector @@ q
+    ORDER BY rank, h.id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+def build_fts5_query(query: str, user_id: int) -> str:
+    """
+    Turn free text into an FTS5 query over one user's terms: every word quoted
+    and required, the last one as a prefix
+    """
+    terms = [f'"{user_term(user_id, word)}"' for word in SQLITE_WORD_PATTERN.findall(query)[:SEARCH_MAX_TERMS]]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+def search_history(db: Session, user_id: int, query: str, limit: int = SEARCH_PAGE_SIZE,
+                   offset: int = 0) -> ChatSearchPage:
+    """Search a user's chat history, best matches first (lower rank is better)"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        statement, query = SQLITE_SEARCH_QUERY, build_fts5_query(query, user_id)
+    elif dialect == "postgresql" and SEARCH_INDEX_READY:
+        statement = POSTGRES_SEARCH_QUERY
+    else:
+        return ChatSearchPage(items=[])
+
+    if not query.strip():
+        return ChatSearchPage(items=[])
+
+    # Fetch one extra row to know whether another page exists
+    rows = db.execute(statement, {
+        "query": query,
+        "user_id": user_id,
+        "limit": limit + 1,
+        "offset": offset,
+    }).all()
+
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if offset + limit <= SEARCH_MAX_OFFSET:
+            next_offset = offset + limit
+
+    return ChatSearchPage(
+        items=[ChatSearchResult(**row._mapping) for row in rows],
+        next_offset=next_offset
+    )
+
+# Create (SQLite) or check (PostgreSQL) the search index
+SEARCH_INDEX_READY = ensure_search_index()
@@ -0,0 +1,163 @@
+import os
+import math
+import asyncio
+import hashlib
+import logging
+import secrets
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import Column, Integer, String, DateTime, Index, select, update
+from sqlalchemy.orm import Session
+
+# Import database configuration
+from database_config import Base, engine
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SESSION_AUTH = os.getenv("AUTH_MODE", "jwt").lower() == "session"
+SESSION_REFRESH_INTERVAL = float(os.getenv("SESSION_REFRESH_INTERVAL", "2"))
+SESSION_BLOOM_CAPACITY = int(os.getenv("SESSION_BLOOM_CAPACITY", "100000"))
+SESSION_BLOOM_ERROR_RATE = 0.01
+# Re-read a small window before the watermark to tolerate commit ordering
+SESSION_REFRESH_OVERLAP = timedelta(seconds=5)
+
+# Database Models
+class UserSession(Base):
+    """Server-side session - mirrors the user_sessions table in database/init.sql"""
+    __tablename__ = "user_sessions"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, index=True)
+    session_token = Column(String(255), unique=True, index=True, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Incremental refresh reads rows by updated_at
+user_sessions_updated_index = Index("idx_user_sessions_updated_at", UserSession.updated_at)
+
+# Create tables and indexes
+Base.metadata.create_all(bind=engine)
+user_sessions_updated_index.create(bind=engine, checkfirst=True)
+
+class BloomFilter:
+    """Fixed-size bloom filter over strings (no false negatives)"""
+
+    def __init__(self, capacity: int, error_rate: float = SESSION_BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class SessionRevocationCache:
+    """
+    In-memory view of revoked sessions. A revoked session is a user_sessions row
+    whose expires_at was moved into the past; rows are picked up incrementally by
+    updated_at. Lookups hit the bloom filter first and only consult the exact set
+    on a (rare) bloom match, so a request never touches the database.
+    """
+
+    def __init__(self, token_lifetime: timedelta, capacity: int = SESSION_BLOOM_CAPACITY):
+        self.token_lifetime = token_lifetime
+        self._lock = threading.Lock()
+        # session_token -> time after which its JWT has expired anyway
+        self._revoked: Dict[str, datetime] = {}
+        self._bloom = BloomFilter(capacity)
+        self._watermark: Optional[datetime] = None
+
+    def is_revoked(self, session_token: str) -> bool:
+        return session_token in self._bloom and session_token in self._revoked
+
+    def revoke(self, session_token: str, created_at: Optional[datetime] = None):
+        """Mark a session revoked locally (other workers see it on their next refresh)"""
+        forget_after = (created_at or datetime.utcnow()) + self.token_lifetime
+        with self._lock:
+            if session_token not in self._revoked:
+                self._revoked[session_token] = forget_after
+                if len(self._revoked) > self._bloom.capacity:
+                    self._rebuild(self._bloom.capacity * 2)
+                else:
+                    self._bloom.add(session_token)
+
+    def refresh(self, bind=engine) -> int:
+        """Load sessions revoked since the last refresh; returns how many were read"""
+        now = datetime.utcnow()
+        since = (self._watermark - SESSION_REFRESH_OVERLAP) if self._watermark else now - self.token_lifetime
+
+        with bind.connect() as conn:
+            rows = conn.execute(
+                select(UserSession.session_token, UserSession.created_at, UserSession.updated_at)
+                .where(UserSession.updated_at >= since, UserSession.expires_at <= now)
+            ).all()
+
+        for session_token, created_at, updated_at in rows:
+            self.revoke(session_token, created_at)
+            if self._watermark is None or updated_at > self._watermark:
+                self._watermark = updated_at
+        if self._watermark is None:
+            self._watermark = now
+
+        self.prune(now)
+        return len(rows)
+
+    def prune(self, now: datetime):
+        """Forget revocations whose tokens have expired on their own"""
+        with self._lock:
+            expired = [token for token, forget_after in self._revoked.items() if forget_after <= now]
+            if expired:
+                for token in expired:
+                    del self._revoked[token]
+                self._rebuild(self._bloom.capacity)
+
+    def _rebuild(self, capacity: int):
+        # Caller holds the lock
+        bloom = BloomFilter(capacity)
+        for token in self._revoked:
+            bloom.add(token)
+        self._bloom = bloom
+
+# Utility Functions
+def create_session(db: Session, user_id: int, expires_delta: timedelta) -> str:
+    session_token = secrets.token_urlsafe(32)
+    db.add(UserSession(
+        user_id=user_id,
+        session_token=session_token,
+        expires_at=datetime.utcnow() + expires_delta
+    ))
+    db.commit()
+    return session_token
+
+def revoke_session(db: Session, session_token: str):
+    """Revoke by expiring the row (rather than deleting it) so other workers pick it up"""
+    now = datetime.utcnow()
+    db.execute(
+        update(UserSession)
+        .where(UserSession.session_token == session_token)
+        .values(expires_at=now, updated_at=now)
+    )
+    db.commit()
+
+async def run_session_refresher(cache: SessionRevocationCache, interval: float = SESSION_REFRESH_INTERVAL):
+    """Background task that keeps the revocation cache in step with the database"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(cache.refresh)
+        except Exception as e:
+            logger.error(f"Session revocation refresh failed: {e}")
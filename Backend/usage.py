@@ -0,0 +1,255 @@
+import os
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy import Column, Integer, String, Date, DateTime, UniqueConstraint, select, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Import database configuration
+from database_config import Base, SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# Configuration (0 disables a quota)
+DAILY_TOKEN_QUOTA = int(os.getenv("DAILY_TOKEN_QUOTA", "0"))
+MONTHLY_TOKEN_QUOTA = int(os.getenv("MONTHLY_TOKEN_QUOTA", "0"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+
+# Rough token estimates for streams that end before their usage chunk
+CHARS_PER_TOKEN = 4
+IMAGE_TOKEN_ESTIMATE = {"low": 85, "high": 765}
+
+# Database Models
+class TokenUsage(Base):
+    """Per-user, per-model, per-day token counters"""
+    __tablename__ = "token_usage"
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", "model", name="uq_token_usage_user_day_model"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False)
+    model = Column(String(50), nullable=False)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    request_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Create tables
+Base.metadata.create_all(bind=engine)
+
+COUNTER_COLUMNS = ("prompt_tokens", "completion_tokens", "total_tokens", "request_count")
+
+# Pydantic Models
+class UsageResponse(BaseModel):
+    day: date
+    daily_tokens: int
+    monthly_tokens: int
+    daily_quota: Optional[int] = None
+    monthly_quota: Optional[int] = None
+
+class EstimatedUsage(BaseModel):
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+
+# Utility Functions
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def next_month_start(day: date) -> date:
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+def seconds_until(day: date) -> int:
+    return max(1, int((datetime.combine(day, datetime.min.time()) - datetime.utcnow()).total_seconds()))
+
+def estimate_usage(prompt: str, completion: str, image_detail: Optional[str] = None) -> EstimatedUsage:
+    """Estimate the usage of a completion that was cancelled or failed mid-stream"""
+    prompt_tokens = -(-len(prompt) // CHARS_PER_TOKEN)
+    if image_detail:
+        prompt_tokens += IMAGE_TOKEN_ESTIMATE.get(image_detail, IMAGE_TOKEN_ESTIMATE["high"])
+    completion_tokens = -(-len(completion) // CHARS_PER_TOKEN)
+    return EstimatedUsage(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens
+    )
+
+class UsageTracker:
+    """
+    Aggregates token usage in memory and writes it to token_usage in periodic
+    bulk upserts. Quota checks are served from the in-memory totals; a user's
+    totals for the current month are loaded from the database once per process,
+    in a worker thread so the event loop never waits on the query.
+    """
+
+    def __init__(self, daily_quota: int = DAILY_TOKEN_QUOTA, monthly_quota: int = MONTHLY_TOKEN_QUOTA):
+        self.daily_quota = daily_quota
+        self.monthly_quota = monthly_quota
+        self._lock = threading.Lock()
+        # Held across a whole flush and a whole load, so a load never runs while
+        # counters are out of _pending but not yet committed (or being put back)
+        self._flush_lock = threading.Lock()
+        # (user_id, day, model) -> counters not yet written to the database
+        self._pending: Dict[Tuple[int, date, str], List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+        # Running totals used for quota checks
+        self._daily: Dict[Tuple[int, date], int] = defaultdict(int)
+        self._monthly: Dict[Tuple[int, date], int] = defaultdict(int)
+        self._loaded: set = set()
+
+    def _ensure_loaded(self, user_id: int, today: date):
+        month = month_start(today)
+        if (user_id, month) in self._loaded:
+            return
+
+        with self._flush_lock:
+            self._load(user_id, today, month)
+
+    def _load(self, user_id: int, today: date, month: date):
+        if (user_id, month) in self._loaded:
+            return
+
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(TokenUsage.day, func.sum(TokenUsage.total_tokens))
+                .where(TokenUsage.user_id == user_id, TokenUsage.day >= month)
+                .group_by(TokenUsage.day)
+            ).all()
+        finally:
+            db.close()
+
+        with self._lock:
+            if (user_id, month) in self._loaded:
+                return
+            self._loaded.add((user_id, month))
+            # Usage recorded before the load is either in the database already or still pending
+            unflushed = [
+                (day, counters[2]) for (pending_user, day, _), counters in self._pending.items()
+                if pending_user == user_id and day >= month
+            ]
+            for day, tokens in [*rows, *unflushed]:
+                self._monthly[(user_id, month)] += tokens or 0
+                if day == today:
+                    self._daily[(user_id, today)] += tokens or 0
+
+    async def get_usage(self, user_id: int) -> UsageResponse:
+        today = datetime.utcnow().date()
+        if (user_id, month_start(today)) not in self._loaded:
+            await asyncio.to_thread(self._ensure_loaded, user_id, today)
+        return UsageResponse(
+            day=today,
+            daily_tokens=self._daily.get((user_id, today), 0),
+            monthly_tokens=self._monthly.get((user_id, month_start(today)), 0),
+            daily_quota=self.daily_quota or None,
+            monthly_quota=self.monthly_quota or None
+        )
+
+    async def check_quota(self, user_id: int):
+        """Pre-flight check: raise 429 if the user is already over a quota"""
+        usage = await self.get_usage(user_id)
+        if self.daily_quota and usage.daily_tokens >= self.daily_quota:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Daily token quota exceeded. Please try again tomorrow.",
+                headers={"Retry-After": str(seconds_until(usage.day + timedelta(days=1)))}
+            )
+        if self.monthly_quota and usage.monthly_tokens >= self.monthly_quota:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Monthly token quota exceeded.",
+                headers={"Retry-After": str(seconds_until(next_month_start(usage.day)))}
+            )
+
+    def record(self, user_id: int, model: str, usage: Any):
+        """
+        Record the usage of one completion (the OpenAI `completion.usage` object).
+        Never queries the database: totals not loaded yet pick this up when they are.
+        """
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        total_tokens = getattr(usage, "total_tokens", 0) or prompt_tokens + completion_tokens
+        today = datetime.utcnow().date()
+
+        with self._lock:
+            counters = self._pending[(user_id, today, model)]
+            counters[0] += prompt_tokens
+            counters[1] += completion_tokens
+            counters[2] += total_tokens
+            counters[3] += 1
+            if (user_id, month_start(today)) in self._loaded:
+                self._daily[(user_id, today)] += total_tokens
+                self._monthly[(user_id, month_start(today))] += total_tokens
+
+    def flush(self, bind=engine) -> int:
+        """Write pending counters in one bulk upsert; returns the number of rows written"""
+        with self._flush_lock:
+            return self._flush(bind)
+
+    def _flush(self, bind) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0, 0])
+            self._prune(datetime.utcnow().date())
+        if not pending:
+            return 0
+
+        rows = [
+            dict(user_id=user_id, day=day, model=model, updated_at=datetime.utcnow(),
+                 **dict(zip(COUNTER_COLUMNS, counters)))
+            for (user_id, day, model), counters in pending.items()
+        ]
+
+        dialect = postgresql if bind.dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(TokenUsage)
+        statement = statement.on_conflict_do_update(
+            index_elements=["user_id", "day", "model"],
+            set_={
+                **{column: getattr(TokenUsage, column) + getattr(statement.excluded, column)
+                   for column in COUNTER_COLUMNS},
+                "updated_at": statement.excluded.updated_at,
+            }
+        )
+
+        try:
+            with bind.begin() as conn:
+                conn.execute(statement, rows)
+        except Exception as e:
+            logger.error(f"Failed to flush token usage, will retry: {e}")
+            # Put the counters back so they are written on the next flush
+            with self._lock:
+                for key, counters in pending.items():
+                    merged = self._pending[key]
+                    for i, value in enumerate(counters):
+                        merged[i] += value
+            return 0
+
+        return len(rows)
+
+    def _prune(self, today: date):
+        """Drop running totals for past days and months (caller holds the lock)"""
+        month = month_start(today)
+        for key in [key for key in self._daily if key[1] < today]:
+            del self._daily[key]
+        for key in [key for key in self._monthly if key[1] < month]:
+            del self._monthly[key]
+        self._loaded = {key for key in self._loaded if key[1] >= month}
+
+async def run_usage_flusher(tracker: "UsageTracker", interval: float = USAGE_FLUSH_INTERVAL):
+    """Background task that periodically flushes the tracker"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(tracker.flush)
+        except Exception as e:
+            logger.error(f"Token usage flush failed: {e}")
+
+# Process-wide tracker
+usage_tracker = UsageTracker()
@@ -0,0 +1,332 @@
+import os
+import re
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, Set
+
+import orjson
+from fastapi import WebSocket, WebSocketDisconnect, HTTPException, status
+
+from auth import SessionLocal, TokenData, authenticate_token, decode_access_token, session_cache
+from sessions import SESSION_AUTH, SESSION_REFRESH_INTERVAL
+from history import save_chat_history
+from usage import usage_tracker, estimate_usage
+from router import model_router, is_upstream_error
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+WS_AUTH_TIMEOUT = float(os.getenv("WS_AUTH_TIMEOUT", "10"))
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "30"))
+WS_MAX_MESSAGE_LENGTH = 2000
+
+DATA_URL_PATTERN = re.compile(r"data:([\w.+-]+/[\w.+-]+);base64,")
+
+class SlowConsumerError(Exception):
+    """The client stopped reading and the send queue stayed full"""
+
+class SessionRevokedError(Exception):
+    """The connection's session was revoked after it authenticated"""
+
+class ChatSocket:
+    """
+    One chat WebSocket connection.
+
+    Protocol (JSON text frames):
+      client -> {"type": "auth", "token": "<access token>"}          (first frame)
+      client -> {"type": "chat", "id": "1", "message": "...", "image_url": "https://... | data:image/png;base64,...",
+                 "latency_tier": "fast | standard | quality"}
+      client -> {"type": "cancel", "id": "1"}
+      client -> {"type": "ping"}
+      server -> ready | delta | done | cancelled | error | pong
+
+    Outgoing frames go through a bounded queue drained by a single sender task.
+    A slow reader makes the generation wait (and stop pulling from upstream);
+    if the queue stays full for WS_SEND_TIMEOUT seconds the connection is closed.
+    With AUTH_MODE=session the session is re-checked on every incoming frame and
+    every SESSION_REFRESH_INTERVAL seconds, so a logout also closes idle sockets
+    and stops in-progress turns (within the revocation refresh interval).
+    """
+
+    def __init__(self, websocket: WebSocket, client, system_prompt: str,
+                 allowed_image_types: Set[str], max_image_size: int):
+        self.websocket = websocket
+        self.client = client
+        self.system_prompt = system_prompt
+        self.allowed_image_types = allowed_image_types
+        self.max_image_size = max_image_size
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.user = None
+        self.session_id: Optional[str] = None
+        self.turn: Optional[asyncio.Task] = None
+        self.turn_id: Optional[str] = None
+
+    async def run(self):
+        await self.websocket.accept()
+        if not await self.authenticate():
+            return
+
+        sender = asyncio.create_task(self.send_loop())
+        tasks = [asyncio.create_task(self.receive_loop())]
+        if SESSION_AUTH:
+            tasks.append(asyncio.create_task(self.watch_session()))
+        revoked = False
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if isinstance(error, SessionRevokedError):
+                    revoked = True
+                elif error is not None and not isinstance(error, (WebSocketDisconnect, SlowConsumerError)):
+                    raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.turn and not self.turn.done():
+                self.turn.cancel()
+            sender.cancel()
+
+        if revoked:
+            # Queued frames are dropped; the other tasks must be gone before we write directly
+            await asyncio.gather(sender, *tasks, return_exceptions=True)
+            logger.info("Closing chat socket for user %s: session revoked", self.user.username)
+            await self.reject("Session expired or revoked")
+
+    async def authenticate(self) -> bool:
+        """Authenticate once per connection from the first frame"""
+        try:
+            frame = await asyncio.wait_for(self.receive_frame(), WS_AUTH_TIMEOUT)
+            if not isinstance(frame, dict) or frame.get("type") != "auth" or not isinstance(frame.get("token"), str):
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="First message must be an auth message"
+                )
+            token_data = decode_access_token(frame["token"])
+            self.session_id = token_data.session_id
+            self.user = await asyncio.to_thread(self._load_user, token_data)
+        except WebSocketDisconnect:
+            return False
+        except asyncio.TimeoutError:
+            await self.reject("Authentication timed out")
+            return False
+        except HTTPException as e:
+            await self.reject(e.detail)
+            return False
+        except ValueError as e:
+            await self.reject(str(e))
+            return False
+
+        await self.websocket.send_json({"type": "ready", "username": self.user.username})
+        return True
+
+    def _load_user(self, token_data: TokenData):
+        db = SessionLocal()
+        try:
+            return authenticate_token(db, token_data)
+        finally:
+            db.close()
+
+    async def reject(self, detail: str):
+        await self.websocket.send_json({"type": "error", "detail": detail})
+        await self.websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+
+    async def receive_frame(self):
+        """Next client frame as parsed JSON; ValueError for binary frames and invalid JSON"""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+        if message.get("text") is None:
+            raise ValueError("Expected a JSON text frame")
+        try:
+            return orjson.loads(message["text"])
+        except orjson.JSONDecodeError:
+            raise ValueError("Invalid JSON")
+
+    async def send(self, frame: dict):
+        try:
+            await asyncio.wait_for(self.outbox.put(frame), WS_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise SlowConsumerError()
+
+    async def watch_session(self):
+        """Catch revocations on sockets that are idle or only receiving a streamed turn"""
+        while True:
+            await asyncio.sleep(SESSION_REFRESH_INTERVAL)
+            if session_cache.is_revoked(self.session_id):
+                raise SessionRevokedError()
+
+    async def send_loop(self):
+        while True:
+            frame = await self.outbox.get()
+            await self.websocket.send_json(frame)
+
+    async def receive_loop(self):
+        while True:
+            try:
+                frame = await self.receive_frame()
+            except ValueError as e:
+                await self.send({"type": "error", "detail": str(e)})
+                continue
+
+            if SESSION_AUTH and session_cache.is_revoked(self.session_id):
+                raise SessionRevokedError()
+
+            kind = frame.get("type") if isinstance(frame, dict) else None
+            if kind == "chat":
+                await self.start_turn(frame)
+            elif kind == "cancel":
+                self.cancel_turn(frame.get("id"))
+            elif kind == "ping":
+                await self.send({"type": "pong"})
+            else:
+                await self.send({"type": "error", "detail": f"Unknown message type: {kind}"})
+
+    async def start_turn(self, frame: dict):
+        turn_id = str(frame.get("id") or uuid.uuid4().hex)
+        if self.turn and not self.turn.done():
+            await self.send({"type": "error", "id": turn_id, "detail": "A response is already in progress"})
+            return
+
+        message = frame.get("message")
+        message = message.strip() if isinstance(message, str) else ""
+        if not message or len(message) > WS_MAX_MESSAGE_LENGTH:
+            await self.send({
+                "type": "error", "id": turn_id,
+                "detail": f"Message must be between 1 and {WS_MAX_MESSAGE_LENGTH} characters"
+            })
+            return
+
+        image_url = frame.get("image_url")
+        if image_url is not None:
+            error = self.validate_image_reference(image_url)
+            if error:
+                await self.send({"type": "error", "id": turn_id, "detail": error})
+                return
+
+        try:
+            await usage_tracker.check_quota(self.user.id)
+        except HTTPException as e:
+            await self.send({"type": "error", "id": turn_id, "detail": e.detail})
+            return
+
+        self.turn_id = turn_id
+        self.turn = asyncio.create_task(self.generate(turn_id, message, image_url, frame.get("latency_tier")))
+
+    def cancel_turn(self, turn_id: Optional[str]):
+        """Cancel the in-progress generation (server side, including the upstream stream)"""
+        if self.turn and not self.turn.done() and (turn_id is None or str(turn_id) == self.turn_id):
+            self.turn.cancel()
+
+    def validate_image_reference(self, image_url) -> Optional[str]:
+        if not isinstance(image_url, str):
+            return "image_url must be a string"
+        if image_url.startswith("https://"):
+            return None
+
+        match = DATA_URL_PATTERN.match(image_url)
+        if not match:
+            return "image_url must be an https:// URL or a base64 data URL"
+        if match.group(1) not in self.allowed_image_types:
+            return f"File type {match.group(1)} not allowed. Supported types: {', '.join(self.allowed_image_types)}"
+        if (len(image_url) - match.end()) * 3 // 4 > self.max_image_size:
+            return f"File size exceeds maximum allowed size of {self.max_image_size/1024/1024:.1f}MB"
+        return None
+
+    async def generate(self, turn_id: str, message: str, image_url: Optional[str], latency_tier: Optional[str]):
+        decision = model_router.route(message, has_image=bool(image_url), tier=latency_tier)
+        if image_url:
+            messages = [{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": message},
+                    {"type": "image_url", "image_url": {"url": image_url, "detail": decision.detail}}
+                ]
+            }]
+        else:
+            messages = [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": message}
+            ]
+
+        def estimated_usage():
+            prompt = message if image_url else f"{self.system_prompt}\n{message}"
+            return estimate_usage(prompt, "".join(parts), decision.detail if image_url else None)
+
+        stream = None
+        parts = []
+        usage = None
+        recorded = False
+        try:
+            for model_used in decision.models:
+                usage = None
+                try:
+                    with model_router.track(model_used):
+                        stream = await self.client.chat.completions.create(
+                            model=model_used,
+                            messages=messages,
+                            max_tokens=decision.max_tokens,
+                            temperature=0.7,
+                            stream=True,
+                            stream_options={"include_usage": True}
+                        )
+
+                        async for chunk in stream:
+                            if chunk.usage:
+                                usage = chunk.usage
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                parts.append(chunk.choices[0].delta.content)
+                                await self.send({"type": "delta", "id": turn_id, "content": chunk.choices[0].delta.content})
+                    break
+                except SlowConsumerError:
+                    raise
+                except Exception as e:
+                    # Only fall back on upstream errors, and only if nothing has been streamed yet
+                    if parts or model_used == decision.models[-1] or not is_upstream_error(e):
+                        raise
+                    logger.warning(f"Model {model_used} failed, trying fallback: {e}")
+                    model_router.note_fallback(model_used)
+                    if stream is not None:
+                        usage_tracker.record(self.user.id, model_used, usage or estimated_usage())
+                        await stream.close()
+                        stream = None
+
+            usage_tracker.record(self.user.id, model_used, usage or estimated_usage())
+            recorded = True
+            response_content = "".join(parts) or "I apologize, but I couldn't generate a response."
+            await asyncio.to_thread(save_chat_history, self.user.id, message, response_content, model_used)
+
+            await self.send({
+                "type": "done",
+                "id": turn_id,
+                "model_used": model_used,
+                "timestamp": datetime.now().isoformat()
+            })
+
+        except asyncio.CancelledError:
+            try:
+                self.outbox.put_nowait({"type": "cancelled", "id": turn_id})
+            except asyncio.QueueFull:
+                pass
+            raise
+        except SlowConsumerError:
+            logger.warning(f"Closing chat socket for user {self.user.username}: client is not reading")
+            await self.websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        except Exception as e:
+            logger.error(f"Error in chat socket for user {self.user.username}: {str(e)}")
+            try:
+                await self.send({
+                    "type": "error",
+                    "id": turn_id,
+                    "detail": "Sorry, I'm having trouble processing your request. Please try again."
+                })
+            except SlowConsumerError:
+                pass
+        finally:
+            if stream is not None:
+                if not recorded:
+                    # Cancelled or failed mid-stream: upstream still bills the tokens
+                    usage_tracker.record(self.user.id, model_used, usage or estimated_usage())
+                await stream.close()